@@ -5,8 +5,9 @@ Implements a CLI using `click` to be used in the terminal.
 
 Calling this tool starts a subprocess that list top-level derivations (outputPath + attribute path) to its stderr pipe, see `./find-attribute-paths.nix`.
 This pipe is consumed in a thread (`finder_output_reader`) that reads each line and feeds found attribute paths to a queue.
-This queue is consumed by another thread (`queue_processor`) that will call a subprocess that describes the derivation (name, version, license, dependencies, ...), see `./describe-derivation.nix`.
+This queue is consumed by another thread (`queue_processor`) that will call a subprocess that describes a batch of derivations (name, version, license, dependencies, ...), see `./describe-derivation.nix`.
 When describing a derivation, if dependencies are found and have not been already queued for processing, they are added to the queue as well, which makes us explore the entire depth of the graph.
+Descriptions are serialized by the workers and written to the output file by a single thread (`output_writer`).
 
 The whole system stops once
 - all top-level attribute paths have been found
@@ -19,86 +20,155 @@ Glossary:
 - attribute path: path from the root attribute set to get the desired value.
                   e.g. python3Derivations.versioneer
 """  # noqa
-import copy
-import json
+import io
 import logging
 import multiprocessing.pool
 import os
 import pathlib
 import subprocess
 import sys
-from queue import Empty
-from threading import Lock
-from typing import IO
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from threading import Event, Lock
+from typing import IO, Iterator
 
 import click
+import orjson
+from pydantic import ValidationError
 
 from nixtract import model
 from nixtract.threading import thread
 
+# Nix expressions used to find and describe derivations
+FIND_ATTRIBUTE_PATHS_NIX_PATH = str(
+    pathlib.Path(__file__).parent.joinpath("find-attribute-paths.nix")
+)
+DESCRIBE_DERIVATION_NIX_PATH = str(
+    pathlib.Path(__file__).parent.joinpath("describe-derivation.nix")
+)
+
+# size of the buffer of the finder output pipe, and of the chunks read from it
+PIPE_BUFFER_SIZE = 1 << 20
+
+# beginning of the lines traced by `find-attribute-paths.nix` for found derivations
+FINDER_TRACE_PREFIX = b'trace: {"foundDrvs":'
+
+
+def read_lines(
+    pipe_in: io.BufferedReader, chunk_size: int = PIPE_BUFFER_SIZE
+) -> Iterator[bytes]:
+    """
+    Iterate over the lines of a pipe, without line endings, by reading it in chunks of
+    what is available instead of one line at a time
+    """
+    tail = b""
+    while chunk := pipe_in.read1(chunk_size):
+        lines = (tail + chunk).split(b"\n")
+        # the last element is an incomplete line, or empty when the chunk ends a line
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
 
 @thread
 def finder_output_reader(
-    pipe_in: IO[bytes],
-    queue: multiprocessing.Queue,
+    pipe_in: io.BufferedReader,
+    stop: Event,
+    queue: SimpleQueue,
     queued_output_paths: set[str],
+    queued_output_paths_lock: Lock,
     logger: logging.Logger,
 ):
     """Read lines from finder standard output to push found attribute paths to queue"""
     with pipe_in:
         line_bytes: bytes
         # read incoming lines
-        for line_bytes in iter(pipe_in.readline, b""):
-            line: str = line_bytes.decode()
-
-            if not line.startswith("trace: "):
-                sys.stderr.write(line)
+        for line_bytes in read_lines(pipe_in):
+            # another task failed, found derivations would not be processed
+            if stop.is_set():
+                break
+
+            # forward other lines, e.g. warnings or traces from nixpkgs, without
+            # attempting to parse them
+            if not line_bytes.startswith(FINDER_TRACE_PREFIX):
+                sys.stderr.write(line_bytes.decode(errors="replace") + "\n")
                 continue
 
-            # remove beginning "trace:"
-            trace = line[6:]
-
             try:
-                # FIXME use pydantic
-                parsed_found_derivations: list[dict[str, str]] = json.loads(trace)[
-                    "foundDrvs"
-                ]
+                # parse without the beginning "trace: "
+                found_derivations = model.finder_trace_adapter().validate_json(
+                    line_bytes[7:]
+                )["foundDrvs"]
             except Exception:
-                # fail silently, most likely some other trace from nixpkgs
-                sys.stderr.write(line)
+                # fail silently, not a valid trace of found derivations
+                sys.stderr.write(line_bytes.decode(errors="replace") + "\n")
                 continue
 
             # push found derivations to queue if they haven't been queued already
-            for found_derivation in parsed_found_derivations:
+            for found_derivation in found_derivations:
                 attribute_path = found_derivation.get("attributePath")
                 output_path = found_derivation.get("outputPath")
                 if attribute_path is None or output_path is None:
-                    logger.warning("Wrong derivation: %s", json.dumps(found_derivation))
+                    logger.warning("Wrong derivation: %s", found_derivation)
                     continue
-                if output_path not in queued_output_paths:
-                    queue.put(attribute_path)
+                with queued_output_paths_lock:
+                    if output_path in queued_output_paths:
+                        continue
                     queued_output_paths.add(output_path)
+                queue.put(attribute_path)
+
 
+def validate_descriptions(
+    descriptions_json: bytes, logger: logging.Logger
+) -> list[model.Derivation]:
+    """
+    Validate a JSON list of descriptions against the model, invalid descriptions are
+    logged and skipped instead of failing the whole list
+    """
+    try:
+        return model.derivation_list_adapter().validate_json(descriptions_json)
+    except ValidationError:
+        pass
 
-def process_attribute_path(
-    pipe_out: IO[str],
-    pipe_out_lock: Lock,
-    queue: multiprocessing.Queue,
+    # validate each description on its own to keep the valid ones
+    descriptions: list[model.Derivation] = []
+    for data in orjson.loads(descriptions_json):
+        try:
+            descriptions.append(model.Derivation.model_validate(data))
+        except ValidationError as e:
+            logger.warning(
+                "Invalid description: attribute_path=%s, error=%s",
+                data.get("attributePath") if isinstance(data, dict) else None,
+                e,
+            )
+    return descriptions
+
+
+def process_attribute_paths(
+    writer_queue: SimpleQueue,
+    stop: Event,
+    queue: SimpleQueue,
     queued_output_paths: set[str],
+    queued_output_paths_lock: Lock,
     visited_output_paths: set[str],
     finder_env: dict,
     offline: bool,
-    attribute_path: str,
+    attribute_paths: list[str],
     logger: logging.Logger,
 ):
     """
-    Describe a derivation, write results to output pipe and add potential derivations
-    to process to queue
+    Describe derivations in a single Nix evaluation, push results to the writer queue
+    and add potential derivations to process to queue
     """
+    # skip evaluations still pending in the pool once a task failed
+    if stop.is_set():
+        return False
 
-    # evaluate value at the attribute path using Nix
-    env = copy.deepcopy(finder_env)
-    env["TARGET_ATTRIBUTE_PATH"] = attribute_path
+    # evaluate values at the attribute paths using Nix
+    env = finder_env | {
+        "TARGET_ATTRIBUTE_PATHS": orjson.dumps(attribute_paths).decode()
+    }
     description_process = subprocess.run(
         args=[
             arg
@@ -110,7 +180,7 @@ def process_attribute_path(
                 "nix-command flakes",
                 "--json",
                 "--file",
-                str(pathlib.Path(__file__).parent.joinpath("describe-derivation.nix")),
+                DESCRIBE_DERIVATION_NIX_PATH,
             ]
             if arg is not None
         ],
@@ -119,40 +189,68 @@ def process_attribute_path(
         env=env,
     )
 
-    description_str = description_process.stdout.decode()
-    if len(description_str) == 0:
-        logger.warning("Empty evaluation: %s", attribute_path)
-        logger.error(description_process.stdout)
+    if len(description_process.stdout) == 0:
+        if len(attribute_paths) > 1:
+            # a single failing derivation fails the whole evaluation, so we retry each
+            # attribute path on its own to still describe the other derivations
+            logger.warning("Failed batch evaluation: %s", attribute_paths)
+            for attribute_path in attribute_paths:
+                process_attribute_paths(
+                    writer_queue,
+                    stop,
+                    queue,
+                    queued_output_paths,
+                    queued_output_paths_lock,
+                    visited_output_paths,
+                    finder_env,
+                    offline,
+                    [attribute_path],
+                    logger,
+                )
+            return True
+        logger.warning("Empty evaluation: %s", attribute_paths[0])
+        # the output is empty, the reason of the failure is in the error output
+        logger.error(description_process.stderr.decode(errors="replace"))
         return True
 
-    # add its inputs to the queue if they have not been processed
     try:
-        description: model.Derivation = model.Derivation.parse_raw(description_str)
+        descriptions = validate_descriptions(description_process.stdout, logger)
     except Exception as e:
         logger.warning(
-            "Failed to parse to model: attribute_path=%s, str=",
-            attribute_path,
-            description_str,
+            "Failed to parse to model: attribute_paths=%s, str=%s",
+            attribute_paths,
+            description_process.stdout.decode(errors="replace"),
         )
-        logger.error(description_process.stdout)
         raise e from e
 
-    if description.output_path is None:
-        logger.warning("Ignore empty outputPath: %s", attribute_path)
-        return True
+    # a task failed during the evaluation, don't queue its build inputs
+    if stop.is_set():
+        return False
+
+    lines: list[bytes] = []
+    for description in descriptions:
+        if description.output_path is None:
+            logger.warning("Ignore empty outputPath: %s", description.attribute_path)
+            continue
 
-    # write to output pipe
-    with pipe_out_lock:
-        pipe_out.write(description.json(by_alias=False))
-        pipe_out.write("\n")
+        lines.append(orjson.dumps(description.model_dump()) + b"\n")
 
-    visited_output_paths.add(description.output_path)
-    for build_input in description.build_inputs:
-        output_path = build_input.output_path
-        attribute_path = build_input.attribute_path
-        if output_path is not None and output_path not in queued_output_paths:
+        # add its inputs to the queue if they have not been processed
+        visited_output_paths.add(description.output_path)
+        for build_input in description.build_inputs:
+            output_path = build_input.output_path
+            attribute_path = build_input.attribute_path
+            if output_path is None:
+                continue
+            with queued_output_paths_lock:
+                if output_path in queued_output_paths:
+                    continue
+                queued_output_paths.add(output_path)
             queue.put(attribute_path)
-            queued_output_paths.add(output_path)
+
+    # hand serialized descriptions to the writer thread
+    if len(lines) > 0:
+        writer_queue.put(b"".join(lines))
 
     # return success
     return True
@@ -160,15 +258,17 @@ def process_attribute_path(
 
 @thread
 def queue_processor(
-    outfile: IO[str],
-    outfile_lock: Lock,
-    finder_process: subprocess.Popen,
+    writer_queue: SimpleQueue,
+    finder_done: Event,
+    stop: Event,
     pool: multiprocessing.pool.ThreadPool,
-    queue: multiprocessing.Queue,
+    queue: SimpleQueue,
     queued_output_paths: set[str],
+    queued_output_paths_lock: Lock,
     visited_output_paths: set[str],
     finder_env: dict,
     offline: bool,
+    batch_size: int,
     logger: logging.Logger,
 ):
     """Continuously process attribute paths in the queue to the pool"""
@@ -178,55 +278,72 @@ def queue_processor(
 
     def try_queue_get():
         try:
-            return queue.get(block=True, timeout=1)
+            # short timeout, as evaluations resolving do not notify this thread
+            return queue.get(block=True, timeout=0.05)
         except Empty:
             return None
 
     # main loop of task
     while (
+        # no task failed
+        not stop.is_set()
+    ) and (
         # there is an attribute path to process
-        # FIXME this is active polling, a notification system would save resources
         (attribute_path := try_queue_get()) is not None
+        # the finder output has not been entirely read
+        # (checked before the queue, as the reader pushes to it until it is done)
+        or not finder_done.is_set()
         # there are attribute paths to process
         or not queue.empty()
-        # the finder process is still running
-        or finder_process.poll() is None
         # there are promises which have yet to resolve
         or len(pool_promises) > 0
     ):
         # filter promises to keep unresolved ones
+        unresolved_promises: list[multiprocessing.pool.AsyncResult] = []
         for promise in pool_promises:
-            if promise.ready():
-                # evaluation is done, remove it
-                pool_promises.remove(promise)
-                # check success
-                try:
-                    promise.get()
-                except Exception as e:
-                    logger.exception(e)
-
-        logger.info(
-            "visited=%s,queue=%s,promises=%s",
-            len(visited_output_paths),
-            queue.qsize(),
-            len(pool_promises),
-        )
+            if not promise.ready():
+                unresolved_promises.append(promise)
+                continue
+            # evaluation is done, check success
+            try:
+                promise.get()
+            except Exception as e:
+                logger.exception(e)
+        pool_promises = unresolved_promises
+
+        # logged on every iteration, avoid computing arguments when it is disabled
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "visited=%s,queue=%s,promises=%s",
+                len(visited_output_paths),
+                queue.qsize(),
+                len(pool_promises),
+            )
         # if no attribute path in the queue, look for the next one
         if attribute_path is None:
             continue
 
-        # process attribute path
+        # take more attribute paths if available to describe them in the same evaluation
+        attribute_paths = [attribute_path]
+        while len(attribute_paths) < batch_size:
+            try:
+                attribute_paths.append(queue.get_nowait())
+            except Empty:
+                break
+
+        # process attribute paths
         promise = pool.apply_async(
-            func=process_attribute_path,
+            func=process_attribute_paths,
             args=[
-                outfile,
-                outfile_lock,
+                writer_queue,
+                stop,
                 queue,
                 queued_output_paths,
+                queued_output_paths_lock,
                 visited_output_paths,
                 finder_env,
                 offline,
-                attribute_path,
+                attribute_paths,
                 logger,
             ],
         )
@@ -235,10 +352,36 @@ def queue_processor(
     logger.info("QUEUE PROCESSOR CLOSED")
 
 
+@thread
+def output_writer(
+    pipe_out: IO[bytes],
+    writer_queue: SimpleQueue,
+):
+    """
+    Write serialized derivations from the writer queue to output pipe, until None is
+    pulled from the queue
+    """
+    done = False
+    while not done:
+        # wait for something to write
+        chunks = [writer_queue.get()]
+        # take what is already available to write it all at once
+        while len(chunks) < 64:
+            try:
+                chunks.append(writer_queue.get_nowait())
+            except Empty:
+                break
+        # None is pushed last, once workers are done
+        if chunks[-1] is None:
+            chunks.pop()
+            done = True
+        pipe_out.write(b"".join(chunks))
+
+
 @click.command()
 @click.argument(
     "outfile",
-    type=click.File("wt"),
+    type=click.File("wb"),
 )
 @click.option(
     "--target-flake-ref",
@@ -261,6 +404,12 @@ def queue_processor(
     type=int,
     help="Count of workers to spawn to describe the stream of found derivations",
 )
+@click.option(
+    "--batch-size",
+    default=10,
+    type=click.IntRange(min=1),
+    help="Maximum count of derivations to describe in a single Nix evaluation",
+)
 @click.option(
     "--offline",
     is_flag=True,
@@ -273,11 +422,12 @@ def queue_processor(
     help="Increase verbosity",
 )
 def cli(
-    outfile: IO[str],
+    outfile: IO[bytes],
     target_flake_ref: str,
     target_attribute_path: str,
     target_system: str,
     n_workers: int,
+    batch_size: int,
     offline: bool,
     verbose: bool,
 ):
@@ -322,15 +472,16 @@ def cli(
                 "nix-command flakes",
                 "--json",
                 "--file",
-                str(pathlib.Path(__file__).parent.joinpath("find-attribute-paths.nix")),
+                FIND_ATTRIBUTE_PATHS_NIX_PATH,
             ]
             if arg is not None
         ],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
+        bufsize=PIPE_BUFFER_SIZE,
         env=finder_env,
     )
-    assert finder_process.stderr is not None
+    assert isinstance(finder_process.stderr, io.BufferedReader)
 
     # while we find these derivations directly available, we process found derivations
     # at the same time to describe them, but also to find derivations indirectly
@@ -338,49 +489,86 @@ def cli(
     derivation_description_pool = multiprocessing.pool.ThreadPool(n_workers)
 
     # we can't access the pool queue so we use our own (thanks encapsulation U_U)
-    derivation_description_queue = multiprocessing.Queue()
+    derivation_description_queue = SimpleQueue()
     # we don't want to process the same derivation twice, so we use their output path to
     # check that
     queued_output_paths: set[str] = set()
     visited_output_paths: set[str] = set()
-
-    # we need to use a mutex lock to make sure we write one line at a time
-    outfile_lock = Lock()
+    # derivations are found by the reader thread and by workers at the same time, the
+    # lock makes checking and marking an output path as queued atomic
+    queued_output_paths_lock = Lock()
+
+    # set once all derivations found by the finder have been pushed to the queue
+    finder_done = Event()
+    # set once a task failed, so that the others stop instead of exploring the graph
+    # for nothing
+    stop = Event()
+
+    def stop_on_failure(task: Future):
+        if task.exception() is not None:
+            stop.set()
+
+    # a single thread writes to the output file, so that workers never wait on it
+    writer_queue = SimpleQueue()
+    writer_task = output_writer(outfile, writer_queue)
+    # e.g. the output pipe has been closed, there is no point in going on
+    writer_task.add_done_callback(stop_on_failure)
 
     # read derivations found by the finder to feed the processing queue
-    reader_thread = finder_output_reader(
+    reader_task = finder_output_reader(
         finder_process.stderr,
+        stop,
         derivation_description_queue,
         queued_output_paths,
+        queued_output_paths_lock,
         logger,
     )
-    reader_thread.start()
+    reader_task.add_done_callback(stop_on_failure)
 
     # process derivations pushed to the processing queue
-    process_queue_thread = queue_processor(
-        outfile,
-        outfile_lock,
-        finder_process,
+    process_queue_task = queue_processor(
+        writer_queue,
+        finder_done,
+        stop,
         derivation_description_pool,
         derivation_description_queue,
         queued_output_paths,
+        queued_output_paths_lock,
         visited_output_paths,
         finder_env,
         offline,
+        batch_size,
         logger,
     )
-    process_queue_thread.start()
+    process_queue_task.add_done_callback(stop_on_failure)
 
     # all is done once finder is done, reader is done and processing queue is done
-    finder_process.wait()
-    logger.info("FINDER EXIT")
-    reader_thread.join()
-    logger.info("READER THREAD EXIT")
-    process_queue_thread.join()
-    logger.info("PROCESS QUEUE THREAD EXIT")
-    derivation_description_pool.close()
-    derivation_description_pool.join()
-    logger.info("POOL EXIT")
+    # results of the tasks are retrieved to raise exceptions that occurred in them
+    try:
+        # the reader is waited for first, as the finder blocks on a full pipe if the
+        # reader failed
+        reader_task.result()
+        # the reader stopped early as another task failed
+        if stop.is_set():
+            finder_process.kill()
+        finder_process.wait()
+        logger.info("FINDER EXIT")
+        finder_done.set()
+        logger.info("READER THREAD EXIT")
+        process_queue_task.result()
+        logger.info("PROCESS QUEUE THREAD EXIT")
+        derivation_description_pool.close()
+        derivation_description_pool.join()
+        logger.info("POOL EXIT")
+    finally:
+        # let the remaining tasks stop if one of them failed
+        stop.set()
+        if finder_process.poll() is None:
+            finder_process.kill()
+        finder_done.set()
+        writer_queue.put(None)
+    writer_task.result()
+    logger.info("WRITER THREAD EXIT")
 
     if not derivation_description_queue.empty():
         logger.error("Finished but queue is not empty")
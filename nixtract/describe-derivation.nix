@@ -1,12 +1,12 @@
-# Describe a derivation
+# Describe a list of derivations
 #
 # Args (as environment variables):
 #     TARGET_FLAKE_REF: flake reference to evaluate
 #     TARGET_SYSTEM: system to evaluate
-#     TARGET_ATTRIBUTE_PATH: attribute path to the derivation to evaluate
+#     TARGET_ATTRIBUTE_PATHS: JSON list of attribute paths to the derivations to evaluate
 #
 # Example:
-# TARGET_FLAKE_REF="nixpkgs" TARGET_SYSTEM="x86_64-linux" TARGET_ATTRIBUTE_PATH="python3" nix eval --json --file describe-derivation.nix
+# TARGET_FLAKE_REF="nixpkgs" TARGET_SYSTEM="x86_64-linux" TARGET_ATTRIBUTE_PATHS='["python3"]' nix eval --json --file describe-derivation.nix
 
 let
   nixpkgs = builtins.getFlake "nixpkgs";
@@ -15,77 +15,88 @@ let
   # Arguments have to be taken from environment when using `nix` command
   targetFlakeRef = builtins.getEnv "TARGET_FLAKE_REF";
   targetSystem = builtins.getEnv "TARGET_SYSTEM";
-  targetAttributePath = builtins.getEnv "TARGET_ATTRIBUTE_PATH";
+  targetAttributePaths = builtins.fromJSON (builtins.getEnv "TARGET_ATTRIBUTE_PATHS");
 
   # Get pkgs
   targetFlake = builtins.getFlake targetFlakeRef;
   targetFlakePkgs = lib.getFlakePkgs targetFlake targetSystem;
 
-  # Get target value
-  targetValue = lib.getValueAtPath targetFlakePkgs targetAttributePath;
-in
-{
-  name = targetValue.name;
-  parsedName = (builtins.parseDrvName targetValue.name);
-  attributePath = targetAttributePath;
-  nixpkgsMetadata =
+  # Describe the derivation at the given attribute path
+  describeDerivation = targetAttributePath:
+    let
+      # Get target value
+      targetValue = lib.getValueAtPath targetFlakePkgs targetAttributePath;
+
+      # Looked up once as they are used by several fields
+      meta = targetValue.meta or { };
+      license = meta.license or null;
+    in
     {
-      description = (builtins.tryEval (targetValue.meta.description or "")).value;
-      pname = (builtins.tryEval (targetValue.pname or false)).value or null;
-      version = (builtins.tryEval (targetValue.version or "")).value;
-      broken = (builtins.tryEval (targetValue.meta.broken or false)).value;
-      homepage = (builtins.tryEval (targetValue.meta.homepage or "")).value;
-      licenses = (builtins.tryEval (
-        if builtins.isAttrs (targetValue.meta.license or null)
-        # In case the license attribute is not a list, we produce a singleton list to be consistent
-        then [{
-          spdxId = targetValue.meta.license.spdxId or "";
-          fullName = targetValue.meta.license.fullName or "";
-        }]
-        # In case the license attribute is a list
-        else if builtins.isList (targetValue.meta.license or null)
-        then
-          builtins.map
-            (l: {
-              spdxId = l.spdxId or "";
-              fullName = l.fullName or "";
-            })
-            targetValue.meta.license
-        else null
-      )).value;
-    };
+      name = targetValue.name;
+      parsedName = (builtins.parseDrvName targetValue.name);
+      attributePath = targetAttributePath;
+      nixpkgsMetadata =
+        {
+          # values are checked to be strings to follow the model, e.g. plain derivations
+          # have no pname and some homepages are lists
+          description = lib.safeString (meta.description or "");
+          pname = lib.safeString (targetValue.pname or null);
+          version = lib.safeString (targetValue.version or "");
+          broken = (builtins.tryEval (meta.broken or false)).value;
+          homepage = lib.safeString (meta.homepage or "");
+          licenses = lib.safeEval (
+            if builtins.isAttrs license
+            # In case the license attribute is not a list, we produce a singleton list to be consistent
+            then [{
+              spdxId = license.spdxId or "";
+              fullName = license.fullName or "";
+            }]
+            # In case the license attribute is a list
+            else if builtins.isList license
+            then
+              builtins.map
+                (l: {
+                  spdxId = l.spdxId or "";
+                  fullName = l.fullName or "";
+                })
+                license
+            else null
+          );
+        };
 
-  # path to the evaluated derivation file
-  derivationPath = lib.safePlatformDrvEval targetSystem (drv: drv.drvPath) targetValue;
+      # path to the evaluated derivation file
+      derivationPath = lib.safePlatformDrvEval targetSystem (drv: drv.drvPath) targetValue;
 
-  # path to the realized (=built) derivation
-  # note: we can't name it `outPath` because serialization would only output it instead of dict, see Nix `toString` docs
-  outputPath =
-    # TODO meaningfully represent when it's not the right platform (instead of null)
-    lib.safePlatformDrvEval
-      targetSystem
-      (drv: drv.outPath)
-      targetValue;
-  outputs = map (name: { inherit name; outputPath = lib.safePlatformDrvEval targetSystem (drv: drv.outPath) targetValue.${name}; }) (targetValue.outputs or [ ]);
-  buildInputs = nixpkgs.lib.lists.flatten
-    (map
-      (inputType:
-        map
-          (elem:
-            {
-              buildInputType = nixpkgs.lib.removeSuffix "s" (lib.toSnakeCase inputType);
-              attributePath = targetAttributePath + ".${inputType}.${builtins.toString elem.index}";
-              outputPath = lib.safePlatformDrvEval targetSystem (drv: drv.outPath) elem.value;
-            }
+      # path to the realized (=built) derivation
+      # note: we can't name it `outPath` because serialization would only output it instead of dict, see Nix `toString` docs
+      outputPath =
+        # TODO meaningfully represent when it's not the right platform (instead of null)
+        lib.safePlatformDrvEval
+          targetSystem
+          (drv: drv.outPath)
+          targetValue;
+      outputs = map (name: { inherit name; outputPath = lib.safePlatformDrvEval targetSystem (drv: drv.outPath) targetValue.${name}; }) (targetValue.outputs or [ ]);
+      buildInputs = nixpkgs.lib.lists.flatten
+        (map
+          (inputType:
+            map
+              (elem:
+                {
+                  buildInputType = nixpkgs.lib.removeSuffix "s" (lib.toSnakeCase inputType);
+                  attributePath = targetAttributePath + ".${inputType}.${builtins.toString elem.index}";
+                  outputPath = lib.safePlatformDrvEval targetSystem (drv: drv.outPath) elem.value;
+                }
+              )
+              (
+                # only keep derivations in inputs
+                # TODO include path objects
+                builtins.filter
+                  (elem: nixpkgs.lib.isDerivation elem.value)
+                  (lib.enumerate (targetValue.${inputType} or [ ]))
+              )
           )
-          (
-            # only keep derivations in inputs
-            # TODO include path objects
-            builtins.filter
-              (elem: nixpkgs.lib.isDerivation elem.value)
-              (lib.enumerate (targetValue.${inputType} or [ ]))
-          )
-      )
-      [ "nativeBuildInputs" "buildInputs" "propagatedBuildInputs" ]
-    );
-}
+          [ "nativeBuildInputs" "buildInputs" "propagatedBuildInputs" ]
+        );
+    };
+in
+map describeDerivation targetAttributePaths
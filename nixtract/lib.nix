@@ -8,7 +8,7 @@ rec {
     enumerate [ "a" "b" ]
     => [ { index = 0; value = "a"; } { index = 1; value = "b"; } ]
   */
-  enumerate = lst: map (zippedElem: { index = zippedElem.fst; value = zippedElem.snd; }) (nixpkgs.lib.zipLists (nixpkgs.lib.range 0 (builtins.length lst)) lst);
+  enumerate = lst: builtins.genList (index: { inherit index; value = builtins.elemAt lst index; }) (builtins.length lst);
 
   /* To camel case to snake case
     Type: string -> string
@@ -73,7 +73,36 @@ rec {
 
   /* Utility function for safe evaluation of any value, null if evaluation fails
   */
-  safeEval = v: (builtins.tryEval v).value or null;
+  safeEval =
+    v:
+    let
+      result = builtins.tryEval v;
+    in
+    # on failure, tryEval returns `false` as value
+    if result.success then result.value else null;
+
+  /* Utility for safe evaluation of a value expected to be a string, null if evaluation fails or if it is not a string
+    Numbers are converted to strings.
+    Type: any -> (string | null)
+
+    Examples:
+    safeString "1.0"
+    => "1.0"
+
+    safeString 1
+    => "1"
+
+    safeString [ "https://example.com" ]
+    => null
+  */
+  safeString =
+    v:
+    let
+      value = safeEval v;
+    in
+    if builtins.isString value then value
+    else if builtins.isInt value || builtins.isFloat value then builtins.toString value
+    else null;
 
   /* Utility specific to nixpkgs, as nixpkgs prevents computing some fields if meta.platforms does not contain the target system
     Args:
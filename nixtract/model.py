@@ -1,31 +1,63 @@
-from enum import Enum
+import functools
+import sys
+from typing import Literal
 
-from pydantic import BaseModel, Field
+from pydantic.config import ConfigDict
+from pydantic.fields import Field
+from pydantic.functional_validators import field_validator
+from pydantic.main import BaseModel
+from pydantic.type_adapter import TypeAdapter
+from typing_extensions import TypedDict
 
 
-def snake_case_to_camel_case(name: str):
-    parts = name.split("_")
-    return "".join([parts[0]] + [part.capitalize() for part in parts[1:]])
+class FoundDerivation(TypedDict, total=False):
+    """
+    A derivation found by `find-attribute-paths.nix`, kept as a plain dict.
+
+    Keys are not required, so that a malformed derivation doesn't discard the others
+    found in the same trace.
+    """
+
+    # Attribute path from the flake derivation set
+    attributePath: str | None
+    # The output path of the derivation, None when it can't be built
+    outputPath: str | None
+
+
+class FinderTrace(TypedDict):
+    """A trace of `find-attribute-paths.nix` reporting found derivations"""
+
+    foundDrvs: list[FoundDerivation]
 
 
 class License(BaseModel):
     """The license(s) of a Nix derivation"""
 
+    model_config = ConfigDict(frozen=True, populate_by_name=True)
+
     spdx_id: str | None = Field(
+        alias="spdxId",
+        default=None,
         description="The SPDX Id of the license",
     )
     full_name: str | None = Field(
+        alias="fullName",
+        default=None,
         description="The descriptive full name of the license",
     )
 
-    class Config:
-        alias_generator = snake_case_to_camel_case
-        allow_population_by_field_name = True
+    @field_validator("spdx_id", "full_name")
+    @classmethod
+    def intern_name(cls, name: str | None) -> str | None:
+        # the same few licenses are shared by most derivations
+        return sys.intern(name) if name is not None else None
 
 
 class NixpkgsMetadata(BaseModel):
     """Derivation metadata defined by nixpkgs specifically."""
 
+    model_config = ConfigDict(frozen=True)
+
     description: str | None = Field(
         default=None,
         description="The description of the Nix derivation",
@@ -55,62 +87,78 @@ class NixpkgsMetadata(BaseModel):
 class Output(BaseModel):
     """An output of a derivation, as specified for multi-output derivations."""
 
-    name: str = Field(description="The output path's name (out, doc, dev, ...)")
-    output_path: str = Field(description="The output path")
+    model_config = ConfigDict(frozen=True, populate_by_name=True)
 
-    class Config:
-        alias_generator = snake_case_to_camel_case
-        allow_population_by_field_name = True
+    name: str = Field(description="The output path's name (out, doc, dev, ...)")
+    # None when it can't be built (e.g. wrong platform)
+    output_path: str | None = Field(
+        alias="outputPath",
+        default=None,
+        description="The output path",
+    )
 
 
 class ParsedName(BaseModel):
     """The parsed output of the builtins.parseDrvName function."""
 
+    model_config = ConfigDict(frozen=True)
+
     name: str | None = Field(
         default=None, description="The derivation name of the Nix derivation"
     )
-    version: str | None = Field(description="The version of the Nix derivation")
-
+    version: str | None = Field(
+        default=None, description="The version of the Nix derivation"
+    )
 
-class BuildInputType(Enum):
-    """The type of build input. In Nix there are three different types."""
 
-    BUILD_INPUT = "build_input"
-    PROPAGATED_BUILD_INPUT = "propagated_build_input"
-    NATIVE_BUILD_INPUT = "native_build_input"
+# The type of build input. In Nix there are three different types.
+BuildInputType = Literal["build_input", "propagated_build_input", "native_build_input"]
 
 
 class BuildInput(BaseModel):
     """A build input to a Nix derivation"""
 
+    model_config = ConfigDict(frozen=True, populate_by_name=True)
+
     attribute_path: str = Field(
+        alias="attributePath",
         description="Attribute path from the flake derivation set",
     )
     build_input_type: BuildInputType = Field(
+        alias="buildInputType",
         description="The type of build input",
     )
     # None when it can't be built (e.g. wrong platform)
     output_path: str | None = Field(
+        alias="outputPath",
+        default=None,
         description="The output path of the input derivation",
     )
 
-    class Config:
-        use_enum_values = True
-        alias_generator = snake_case_to_camel_case
-        allow_population_by_field_name = True
-
 
 class Derivation(BaseModel):
     """A Nix derivation, which is an evaluated (not realized) derivation."""
 
+    model_config = ConfigDict(
+        frozen=True,
+        # use the snake_case attribute names in the model class as kwargs constructor
+        populate_by_name=True,
+    )
+
     attribute_path: str = Field(
+        alias="attributePath",
         description="Attribute path from the flake derivation set",
     )
-    derivation_path: str = Field(
+    # None when it can't be evaluated (e.g. wrong platform)
+    derivation_path: str | None = Field(
+        alias="derivationPath",
+        default=None,
         description="The derivation path of this derivation",
     )
     # None when it can't be built (e.g. wrong platform)
     output_path: str | None = Field(
+        alias="outputPath",
+        default=None,
         description="The output path of this derivation",
     )
     outputs: list[Output] = Field(
@@ -121,22 +169,32 @@ class Derivation(BaseModel):
         description="The name of the derivation",
     )
     parsed_name: ParsedName | None = Field(
+        alias="parsedName",
         default=None,
         description=(
             "The parsed derivation name and version of the derivation by Nix builtins"
         ),
     )
     nixpkgs_metadata: NixpkgsMetadata | None = Field(
+        alias="nixpkgsMetadata",
         default=None,
         description="Optional metadata specific to derivations from nixpkgs",
     )
     build_inputs: list[BuildInput] = Field(
+        alias="buildInputs",
         description="The derivation's build inputs",
     )
 
-    class Config:
-        use_enum_values = True
-        # serialize/deserialize JSON with camelCase
-        alias_generator = snake_case_to_camel_case
-        # use the snake_case attribute names in the model class as kwargs constructor
-        allow_population_by_field_name = True
+
+# adapters are built on first use and reused, as building the validator of a type is
+# costly and importing this module should not pay for it
+@functools.cache
+def finder_trace_adapter() -> TypeAdapter[FinderTrace]:
+    """Adapter validating a trace of found derivations"""
+    return TypeAdapter(FinderTrace)
+
+
+@functools.cache
+def derivation_list_adapter() -> TypeAdapter[list[Derivation]]:
+    """Adapter validating a list of derivation descriptions"""
+    return TypeAdapter(list[Derivation])
@@ -1,15 +1,18 @@
-from threading import Thread
-from typing import Callable, ParamSpec
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, ParamSpec, TypeVar
 
 Param = ParamSpec("Param")
+Return = TypeVar("Return")
 
+# threads are created on demand and reused between calls, the default maximum count of
+# threads (at least 5) leaves room for all long-running stages of the CLI at once
+executor = ThreadPoolExecutor(thread_name_prefix="nixtract")
 
-def thread(f: Callable[Param, None]) -> Callable[Param, Thread]:
+
+def thread(f: Callable[Param, Return]) -> Callable[Param, Future[Return]]:
+    @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        return Thread(
-            target=f,
-            args=args,
-            kwargs=kwargs,
-        )
+        return executor.submit(f, *args, **kwargs)
 
     return wrapper  # type: ignore
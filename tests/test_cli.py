@@ -1,7 +1,11 @@
 import json
 import logging
+import os
+import subprocess
 from io import StringIO
 from pathlib import Path
+from queue import SimpleQueue
+from threading import Event, Lock
 
 from click.testing import CliRunner
 
@@ -63,6 +67,7 @@ def test_trivial():
     assert "READER THREAD EXIT" in cli_stderr
     assert "PROCESS QUEUE THREAD EXIT" in cli_stderr
     assert "POOL EXIT" in cli_stderr
+    assert "WRITER THREAD EXIT" in cli_stderr
 
 
 def test_direct_buildinput():
@@ -154,3 +159,132 @@ def test_direct_buildinput():
     assert "READER THREAD EXIT" in cli_stderr
     assert "PROCESS QUEUE THREAD EXIT" in cli_stderr
     assert "POOL EXIT" in cli_stderr
+    assert "WRITER THREAD EXIT" in cli_stderr
+
+
+def test_read_lines():
+    from nixtract.cli import read_lines
+
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "wb") as pipe_out:
+        pipe_out.write(b"first\nsecond line\n\nlast without newline")
+
+    # small chunks to split lines across reads
+    with os.fdopen(read_fd, "rb") as pipe_in:
+        lines = list(read_lines(pipe_in, chunk_size=4))
+
+    assert lines == [b"first", b"second line", b"", b"last without newline"]
+
+
+def test_validate_descriptions():
+    from nixtract.cli import validate_descriptions
+
+    description = {
+        "name": "pkg1",
+        "attributePath": "pkg1",
+        "derivationPath": "/nix/store/pkg1.drv",
+        "outputPath": "/nix/store/pkg1",
+        "outputs": [{"name": "out", "outputPath": "/nix/store/pkg1"}],
+        "buildInputs": [],
+    }
+    # an invalid description should not discard the valid ones of the same batch
+    descriptions_json = json.dumps(
+        [description, {**description, "attributePath": "pkg2", "name": False}]
+    ).encode()
+
+    descriptions = validate_descriptions(descriptions_json, logging.getLogger())
+
+    assert [d.attribute_path for d in descriptions] == ["pkg1"]
+
+
+def test_failed_batch_retries_each_attribute_path(monkeypatch):
+    import nixtract.cli
+    from nixtract.cli import process_attribute_paths
+
+    evaluated_batches = []
+
+    # evaluation of a batch fails as soon as one of its derivations fails
+    def run(args, env, **kwargs):
+        attribute_paths = json.loads(env["TARGET_ATTRIBUTE_PATHS"])
+        evaluated_batches.append(attribute_paths)
+        if "broken" in attribute_paths:
+            return subprocess.CompletedProcess(args, 1, b"", b"error: broken")
+        descriptions = [
+            {
+                "name": attribute_path,
+                "attributePath": attribute_path,
+                "derivationPath": f"/nix/store/{attribute_path}.drv",
+                "outputPath": f"/nix/store/{attribute_path}",
+                "outputs": [],
+                "buildInputs": [],
+            }
+            for attribute_path in attribute_paths
+        ]
+        return subprocess.CompletedProcess(args, 0, json.dumps(descriptions).encode())
+
+    monkeypatch.setattr(nixtract.cli.subprocess, "run", run)
+
+    writer_queue = SimpleQueue()
+    process_attribute_paths(
+        writer_queue,
+        Event(),
+        SimpleQueue(),
+        set(),
+        Lock(),
+        set(),
+        {},
+        False,
+        ["pkg1", "broken", "pkg2"],
+        logging.getLogger(),
+    )
+
+    # the batch is retried one attribute path at a time
+    assert evaluated_batches == [
+        ["pkg1", "broken", "pkg2"],
+        ["pkg1"],
+        ["broken"],
+        ["pkg2"],
+    ]
+    written_nodes = []
+    while not writer_queue.empty():
+        written_nodes += [json.loads(line) for line in writer_queue.get().splitlines()]
+    assert [node["attribute_path"] for node in written_nodes] == ["pkg1", "pkg2"]
+
+
+def test_queue_processor_stops_after_failure(monkeypatch):
+    import multiprocessing.pool
+
+    import nixtract.cli
+    from nixtract.cli import queue_processor
+
+    # no evaluation should be started once a task failed
+    def run(*args, **kwargs):
+        raise AssertionError("unexpected evaluation")
+
+    monkeypatch.setattr(nixtract.cli.subprocess, "run", run)
+
+    queue = SimpleQueue()
+    queue.put("pkg1")
+    stop = Event()
+    stop.set()
+    pool = multiprocessing.pool.ThreadPool(1)
+    task = queue_processor(
+        SimpleQueue(),
+        # the finder is still running
+        Event(),
+        stop,
+        pool,
+        queue,
+        set(),
+        Lock(),
+        set(),
+        {},
+        False,
+        10,
+        logging.getLogger(),
+    )
+
+    task.result(timeout=5)
+    pool.close()
+    pool.join()
+    assert queue.get_nowait() == "pkg1"
@@ -0,0 +1,103 @@
+import warnings
+
+import orjson
+
+# descriptions shaped like the output of `describe-derivation.nix` for the fixtures
+TRIVIAL_DESCRIPTION = {
+    "name": "trivial-1.0",
+    "parsedName": {"name": "trivial", "version": "1.0"},
+    "attributePath": "default",
+    # plain `builtins.derivation`, without pname nor meta
+    "nixpkgsMetadata": {
+        "description": "",
+        "pname": None,
+        "version": "",
+        "broken": False,
+        "homepage": "",
+        "licenses": None,
+    },
+    "derivationPath": "/nix/store/6bhl6v5r2h6j0pvv2ygd9z9l0yw3ps4c-trivial-1.0.drv",
+    "outputPath": "/nix/store/3ah1jb0rlzq0z4vkn3i0z0ya2f0n0wyk-trivial-1.0",
+    "outputs": [
+        {
+            "name": "out",
+            "outputPath": "/nix/store/3ah1jb0rlzq0z4vkn3i0z0ya2f0n0wyk-trivial-1.0",
+        }
+    ],
+    "buildInputs": [],
+}
+PKG2_DESCRIPTION = {
+    "name": "pkg2",
+    "parsedName": {"name": "pkg2", "version": ""},
+    "attributePath": "default",
+    "nixpkgsMetadata": {
+        "description": "",
+        "pname": None,
+        "version": "",
+        "broken": False,
+        "homepage": "",
+        "licenses": [
+            {"spdxId": "MIT", "fullName": "MIT License"},
+            {"spdxId": "Apache-2.0", "fullName": "Apache License 2.0"},
+        ],
+    },
+    "derivationPath": "/nix/store/0vf4vbk8xj4x1ghyd7qmx3l5s2gz3hbr-pkg2.drv",
+    "outputPath": "/nix/store/7qkrj3dm0v4r1zpa7lmsjbfqy1jr6l0c-pkg2",
+    "outputs": [
+        {
+            "name": "out",
+            "outputPath": "/nix/store/7qkrj3dm0v4r1zpa7lmsjbfqy1jr6l0c-pkg2",
+        }
+    ],
+    "buildInputs": [
+        {
+            "buildInputType": "build_input",
+            "attributePath": "default.buildInputs.0",
+            "outputPath": "/nix/store/1dbxrs5b1ixsxph9pjzv2h7k0yxkm6yk-bash-5.1-p16",
+        },
+        {
+            "buildInputType": "build_input",
+            "attributePath": "default.buildInputs.1",
+            "outputPath": "/nix/store/9x2q1fdz0a5dg3r5hq8k1bwmn1jlxk2s-pkg1",
+        },
+    ],
+}
+
+
+def test_descriptions_follow_model():
+    from nixtract import model
+
+    descriptions = [TRIVIAL_DESCRIPTION, PKG2_DESCRIPTION]
+
+    # serialization warns about values not matching the model
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        derivations = model.derivation_list_adapter().validate_json(
+            orjson.dumps(descriptions)
+        )
+        dumped = [derivation.model_dump(by_alias=True) for derivation in derivations]
+
+    # nothing is coerced nor lost on the way
+    assert dumped == descriptions
+    assert derivations[0].nixpkgs_metadata.pname is None
+    assert [
+        license.spdx_id for license in derivations[1].nixpkgs_metadata.licenses
+    ] == ["MIT", "Apache-2.0"]
+
+
+def test_finder_trace_keeps_malformed_derivations():
+    from nixtract import model
+
+    trace = model.finder_trace_adapter().validate_json(
+        b'{"foundDrvs": ['
+        b'{"attributePath": "pkg1", "derivationPath": "/nix/store/pkg1.drv",'
+        b' "outputPath": "/nix/store/pkg1"},'
+        b'{"derivationPath": "/nix/store/pkg2.drv", "outputPath": "/nix/store/pkg2"}'
+        b"]}"
+    )
+
+    # the malformed derivation is left to the reader to report
+    assert trace["foundDrvs"] == [
+        {"attributePath": "pkg1", "outputPath": "/nix/store/pkg1"},
+        {"outputPath": "/nix/store/pkg2"},
+    ]